@@ -6,10 +6,23 @@ import pickle
 import logging
 import time # Added for message timer
 import random # Added for random taunt selection
+import functools
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional; the AI then runs as plain Python
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that returns the function unchanged."""
+        def decorator(func):
+            return func
+        return decorator
 
 # --- Constants ---
 WIDTH, HEIGHT = 650, 650
 ROWS, COLS = 5, 5
+NUM_SQUARES = ROWS * COLS
 SQUARE_SIZE = WIDTH // COLS
 
 # Colors
@@ -23,23 +36,150 @@ SKY_BLUE = (135, 206, 235)
 GREY = (128, 128, 128)
 ORANGE = (255, 165, 0)
 AI_MESSAGE_COLOR = (255, 100, 100) # A reddish color for taunts
+GREEN_HOVER = tuple(min(c + 30, 255) for c in GREEN) # Back button under the cursor
 
-# Piece Symbols
-EMPTY = '.'
-KING = 'K'
-KNIGHT = 'N'
+# Posted when it becomes the AI's turn; main() makes the AI move when it handles it
+AI_MOVE_EVENT = pygame.USEREVENT + 1
+
+# Piece Codes (one byte per square of the flat board)
+EMPTY = 0
+KING = 1
+KNIGHT = 2
+# Saves written before the flat board stored pieces as these characters
+LEGACY_PIECE_CODES = {'.': EMPTY, 'K': KING, 'N': KNIGHT}
 
 # Movesets
-knight_moves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2),
-                (1, -2), (1, 2), (2, -1), (2, 1)]
-king_moves = [(-1, -1), (-1, 0), (-1, 1), (0, -1),
-              (0, 1), (1, -1), (1, 0), (1, 1)]
+knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                (1, -2), (1, 2), (2, -1), (2, 1))
+king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+              (0, 1), (1, -1), (1, 0), (1, 1))
+
+# Safe Zones (iterate the tuple, test membership against SAFE_ZONE_SET)
+safe_zones = ()
+
+# --- Neighbor Tables & Bitboards ---
+# Square index sq = r * COLS + c; a bitboard holds one bit (1 << sq) per square.
+def _neighbor_table(moves):
+    """Lists, for every square, the on-board squares reachable with `moves`."""
+    return [[(r + dr) * COLS + (c + dc) for dr, dc in moves if 0 <= r + dr < ROWS and 0 <= c + dc < COLS]
+            for r in range(ROWS) for c in range(COLS)]
+
+KNIGHT_NEIGHBORS = _neighbor_table(knight_moves)
+KING_NEIGHBORS = _neighbor_table(king_moves)
+KING_CHARGE_NEIGHBORS = _neighbor_table([(dr * 2, dc * 2) for dr, dc in king_moves])
+
+# The tables read by the AI evaluator are tuples so numba can freeze them as constants
+FULL_BB = (1 << (ROWS * COLS)) - 1
+KNIGHT_ATTACKS = tuple(sum(1 << n for n in neighbors) for neighbors in KNIGHT_NEIGHBORS)
+KING_ATTACKS = tuple(sum(1 << n for n in neighbors) for neighbors in KING_NEIGHBORS)
+# Manhattan distance between squares a and b is MANHATTAN[a * NUM_SQUARES + b]
+MANHATTAN = bytes(abs(a // COLS - b // COLS) + abs(a % COLS - b % COLS)
+                  for a in range(NUM_SQUARES) for b in range(NUM_SQUARES))
+# Squares within Manhattan distance 2 of each square
+WITHIN_TWO = tuple(sum(1 << b for b in range(NUM_SQUARES) if MANHATTAN[a * NUM_SQUARES + b] <= 2)
+                   for a in range(NUM_SQUARES))
+SAFE_ZONE_BB = sum(1 << (r * COLS + c) for r, c in safe_zones)
+SAFE_ZONE_SET = frozenset(safe_zones)
+# (1 << sq) % 37 is distinct for every sq < 36, so this maps a single set bit back to its square
+LOW_BIT_SQUARE = tuple(next((sq for sq in range(ROWS * COLS) if (1 << sq) % 37 == m), -1) for m in range(37))
+
+# --- AI Evaluation ---
+# Free functions over bitboards so numba (when installed) can compile them.
+@njit(cache=True, nogil=True)
+def _popcount_loop(bb):
+    """Counts the set bits of a bitboard (numba has no int.bit_count)."""
+    count = 0
+    while bb:
+        bb &= bb - 1
+        count += 1
+    return count
+
+popcount = _popcount_loop if NUMBA_AVAILABLE else int.bit_count
+
+@njit(cache=True, nogil=True)
+def squares_of(bb):
+    """Lists the square index of every set bit in a bitboard, lowest first."""
+    squares = []
+    while bb:
+        low = bb & -bb
+        squares.append(LOW_BIT_SQUARE[low % 37])
+        bb ^= low
+    return squares
+
+@njit(cache=True, nogil=True)
+def attacked_squares(knight_bb):
+    """Returns the bitboard of every square attacked by a knight."""
+    attacked_bb = 0
+    for sq in squares_of(knight_bb):
+        attacked_bb |= KNIGHT_ATTACKS[sq]
+    return attacked_bb
+
+@njit(cache=True, nogil=True)
+def evaluate_position(knight_bb, king_bb, king_sq, turn_count):
+    """Scores a position from the Knights' perspective (see Game.evaluate_board)."""
+    score = 0
+    knight_squares = squares_of(knight_bb)
+    empty_bb = FULL_BB & ~(knight_bb | king_bb)
+    attacked_bb = 0
+    for sq in knight_squares:
+        attacked_bb |= KNIGHT_ATTACKS[sq]
+
+    # Heavily penalize having few knights
+    score += len(knight_squares) * 15
+
+    # Reward restricting king's movement
+    score -= popcount(KING_ATTACKS[king_sq] & ~attacked_bb) * 10
+
+    # Reward knights being close to the king
+    king_dist = king_sq * NUM_SQUARES  # row of MANHATTAN holding distances to the king
+    total_distance = 0
+    for sq in knight_squares:
+        total_distance += MANHATTAN[king_dist + sq]
+
+        # Reward knights that can attack the king in 1 move
+        score += popcount(KNIGHT_ATTACKS[sq] & empty_bb & WITHIN_TWO[king_sq]) * 5
+
+    # Calculate average distance and reward closeness
+    if knight_squares:
+        avg_distance = total_distance / len(knight_squares)
+        score += (7 - avg_distance) * 8  # Prefer knights closer to king
+
+    # Reward surrounding the king
+    surrounding_knights = popcount(KNIGHT_ATTACKS[king_sq] & knight_bb)
+    score += surrounding_knights * 20  # Heavily reward surrounding
+
+    # The safe-zone terms only apply when the board defines safe zones
+    if SAFE_ZONE_BB:
+        safe_squares = squares_of(SAFE_ZONE_BB)
+
+        # Reward knights controlling squares close to safe zones
+        for safe_sq in safe_squares:
+            for sq in knight_squares:
+                if MANHATTAN[safe_sq * NUM_SQUARES + sq] <= 2:
+                    score += 10  # Reward knights close to safe zones
+
+        # Reward knights blocking paths to safe zones
+        min_distance = MANHATTAN[king_dist + safe_squares[0]]
+        for safe_sq in safe_squares:
+            min_distance = min(min_distance, MANHATTAN[king_dist + safe_sq])
+
+        # Knights should prioritize blocking the closest safe zone
+        for sq in knight_squares:
+            for safe_sq in safe_squares:
+                if MANHATTAN[king_dist + safe_sq] == min_distance and MANHATTAN[safe_sq * NUM_SQUARES + sq] <= 2:
+                    score += 15  # Heavily reward blocking the closest safe zone
+
+    # Reward knights that check the king
+    if attacked_bb >> king_sq & 1:
+        score += 25
+
+    # Reward progress through the game (Knights win if game drags on)
+    score += turn_count * 2
 
-# Safe Zones
-safe_zones = []
+    return score
 
 # --- AI Taunt Messages ---
-AI_TAUNTS = [
+AI_TAUNTS = (
     "Is that all you've got?",
     "A lucky shot... won't happen again.",
     "My knights are many, your moves are few.",
@@ -55,46 +195,111 @@ AI_TAUNTS = [
     "Error in calculation... or was it?",
     "That piece was expendable.",
     "Proceed. My traps await.",
-]
+)
 
 # --- Setup Logging ---
-logging.basicConfig(filename='game_log.txt', level=logging.INFO,
+# INFO traces every turn; raise the level to logging.INFO when debugging a game
+logging.basicConfig(filename='game_log.txt', level=logging.WARNING,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+log = logging.getLogger(__name__)
 
 # --- Asset Loading ---
+def load_image(path, alpha=True):
+    """Loads an image already converted to the display's pixel format (call after set_mode)."""
+    image = pygame.image.load(path)
+    return image.convert_alpha() if alpha else image.convert()
+
+@functools.lru_cache(maxsize=32)
+def _font(name, size):
+    """Returns a shared Font for (name, size), so screens and games don't reopen the same face."""
+    return pygame.font.Font(name, size)
+
+@functools.lru_cache(maxsize=16)
+def _load_scaled(path, width, height):
+    """Loads and scales an image once per (path, size); later calls reuse the same Surface."""
+    return pygame.transform.scale(load_image(path), (width, height))
+
 def load_images(size):
     try:
-        king_img = pygame.image.load("King.png").convert_alpha()
-        knight_img = pygame.image.load("knight.png").convert_alpha()
+        king_img = load_image("King.png")
+        knight_img = load_image("knight.png")
         king_img = pygame.transform.scale(king_img, (size - 10, size - 10))
         knight_img = pygame.transform.scale(knight_img, (size - 10, size - 10))
-        logging.info("Images loaded successfully.")
+        log.info("Images loaded successfully.")
         return king_img, knight_img
     except pygame.error as e:
-        logging.error(f"Error loading images: {e}")
-        king_img = pygame.Surface((size - 10, size - 10)); king_img.fill(RED)
-        knight_img = pygame.Surface((size - 10, size - 10)); knight_img.fill(BLUE)
+        log.error("Error loading images: %s", e)
+        king_img = pygame.Surface((size - 10, size - 10)).convert(); king_img.fill(RED)
+        knight_img = pygame.Surface((size - 10, size - 10)).convert(); knight_img.fill(BLUE)
         return king_img, knight_img
     except Exception as e:
-        logging.critical(f"Unexpected error loading images: {e}")
+        log.critical("Unexpected error loading images: %s", e)
         raise
 
+# Screen regions redrawn on state changes (turn indicator strip, bottom status/taunt band)
+INDICATOR_RECT = pygame.Rect(0, 0, WIDTH, SQUARE_SIZE // 2)
+STATUS_RECT = pygame.Rect(0, HEIGHT - 85, WIDTH, 85)
+
+def square_rect(row, col):
+    """Returns the screen rect of the board square (row, col)."""
+    return pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+def build_board_background():
+    """Pre-renders the static board (border, safe zones, checker squares) once."""
+    surface = pygame.Surface((WIDTH, HEIGHT)).convert()
+    surface.fill(BLUE)
+    pygame.draw.rect(surface, YELLOW, (0, 0, WIDTH, HEIGHT), 5)
+
+    # Highlight safe zones lightly
+    for r, c in safe_zones:
+         pygame.draw.rect(surface, (240, 240, 100), square_rect(r, c), 2)
+
+    for row in range(ROWS):
+        for col in range(COLS):
+            pygame.draw.rect(surface, BLACK if (row + col) % 2 == 0 else WHITE, square_rect(row, col))
+    return surface
+
 # --- Game Class ---
 class Game:
     def __init__(self, win, game_mode):
+        # Needs the display mode set first (main() calls set_mode): images and overlays are
+        # convert()ed to the screen's pixel format here so every blit takes the fast path
         self.win = win
         self.game_mode = game_mode
         self.board = self.create_board()
         self.king_img, self.knight_img = load_images(SQUARE_SIZE)
+        self.board_bg = build_board_background()
+        # Fonts come from the shared _font cache; constructing pygame.font.Font per frame is expensive
+        self.font_small = _font(None, 20)
+        self.font_indicator = _font(None, 28)
+        self.font_msg = _font(None, 30)
+        self.font_think = _font(None, 36)
+        self.font_big = _font(None, 74)
+        self._text_cache = {}
+        self._gameover_overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA).convert_alpha()
+        self._gameover_overlay.fill((0, 0, 0, 180))
+        # Every taunt pre-composited onto its semi-transparent backdrop, with its screen position.
+        # Kept premultiplied so one BLEND_PREMULTIPLIED blit matches drawing backdrop and text separately
+        self._taunt_surfs = {}
+        for taunt in AI_TAUNTS:
+            message_surface = self.font_msg.render(taunt, True, AI_MESSAGE_COLOR).convert_alpha().premul_alpha()
+            message_rect = message_surface.get_rect(center=(WIDTH // 2, HEIGHT - 65)) # Position above AI thinking text
+            bg_rect = message_rect.inflate(10, 5)
+            surface = pygame.Surface(bg_rect.size, pygame.SRCALPHA).convert_alpha()
+            surface.fill((0, 0, 0, 150)) # Black background, semi-transparent
+            surface.blit(message_surface, (message_rect.x - bg_rect.x, message_rect.y - bg_rect.y),
+                         special_flags=pygame.BLEND_PREMULTIPLIED)
+            self._taunt_surfs[taunt] = (surface, bg_rect.topleft)
         self.reset_game_state()
 
     def reset_game_state(self):
         """Resets variables for a new game, maintaining game_mode."""
         self.board = self.create_board()
+        self._sync_bitboards()
         self.king_pos = self._find_king()
         self.player_turn = 1
         self.selected_piece_pos = None
-        self.possible_moves = []
+        self.possible_moves = set()
         self.game_over = False
         self.winner = 0
         self.king_kills = 0
@@ -110,259 +315,283 @@ class Game:
         self.ai_message_timer = 0
         self.ai_message_duration = 3.5 # Seconds the message stays on screen
         # --- End AI message state ---
-        logging.info(f"Game state reset. Mode: {self.game_mode}")
+        # --- Display update state: rects changed since the last draw, or a full repaint ---
+        self.dirty = []
+        self._full_repaint = True
+        log.info("Game state reset. Mode: %s", self.game_mode)
 
     def create_board(self):
-        """Initializes the game board."""
-        # --- Unchanged ---
-        board = [[EMPTY for _ in range(COLS)] for _ in range(ROWS)]
-        board[ROWS // 2][COLS // 2] = KING
+        """Initializes the game board as a flat bytearray indexed by r * COLS + c."""
+        board = bytearray(ROWS * COLS)
+        board[(ROWS // 2) * COLS + COLS // 2] = KING
         knights = [(0, 0), (0, COLS - 1), (ROWS - 1, 0), (ROWS - 1, COLS - 1)]
         for r, c in knights:
             if 0 <= r < ROWS and 0 <= c < COLS:
-                board[r][c] = KNIGHT
+                board[r * COLS + c] = KNIGHT
         return board
 
     def _find_king(self):
         """Finds the initial king position."""
-        # --- Unchanged ---
-        for r in range(ROWS):
-            for c in range(COLS):
-                if self.board[r][c] == KING:
-                    return (r, c)
-        logging.error("King not found on initial board setup!")
+        if KING in self.board:
+            return divmod(self.board.index(KING), COLS)
+        log.error("King not found on initial board setup!")
         return (ROWS // 2, COLS // 2)
 
+    def _sync_bitboards(self):
+        """Rebuilds the knight/king bitboards from the board."""
+        self.knight_bb = 0; self.king_bb = 0
+        for sq, piece in enumerate(self.board):
+            if piece == KNIGHT: self.knight_bb |= 1 << sq
+            elif piece == KING: self.king_bb |= 1 << sq
+        self._attacked_key = None
+
+    def _attacked(self):
+        """Returns the bitboard of attacked squares, recomputed only after the knights move."""
+        if self._attacked_key != self.knight_bb:
+            self._attacked_bb = attacked_squares(self.knight_bb); self._attacked_key = self.knight_bb
+        return self._attacked_bb
+
+    def _render(self, font, text, color, bg=None):
+        """Renders text, reusing the surface if the same text was rendered before."""
+        key = (id(font), text, color, bg)
+        surface = self._text_cache.get(key)
+        if surface is None:
+            surface = self._text_cache[key] = font.render(text, True, color, bg)
+        return surface
+
+    def _mark_dirty(self, *rects):
+        """Queues screen rects to be pushed to the display on the next draw."""
+        self.dirty.extend(rects)
+
+    def invalidate(self):
+        """Forces a full repaint on the next draw (e.g. after the window is exposed)."""
+        self._full_repaint = True
+
+    def _mark_highlights(self):
+        """Queues the squares of the current selection and its possible moves."""
+        if self.selected_piece_pos: self.dirty.append(square_rect(*self.selected_piece_pos))
+        self.dirty.extend(square_rect(r, c) for r, c in self.possible_moves)
+
     def draw(self):
-        """Draws the entire game state, including AI messages."""
-        self.win.fill(BLUE)
-        pygame.draw.rect(self.win, YELLOW, (0, 0, WIDTH, HEIGHT), 5)
+        """Draws the entire game state, including AI messages. Does nothing if nothing changed."""
+        if self.ai_message and time.time() >= self.ai_message_timer:
+            self.ai_message = None # Clear message after timer expires
+            self._mark_dirty(STATUS_RECT)
+        if not (self._full_repaint or self.dirty): return
 
-        # Highlight safe zones lightly
-        for r, c in safe_zones:
-             rect = pygame.Rect(c * SQUARE_SIZE, r * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-             pygame.draw.rect(self.win, (240, 240, 100), rect, 2)
+        self.win.blit(self.board_bg, (0, 0))
 
         king_in_check = self.is_square_under_attack(self.king_pos[0], self.king_pos[1]) if self.king_pos else False
 
-        # Draw board squares and pieces
-        for row in range(ROWS):
-            for col in range(COLS):
-                rect = pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-                is_selected = self.selected_piece_pos == (row, col)
-                is_possible_move = (row, col) in self.possible_moves
-                is_king_square_and_check = (row, col) == self.king_pos and king_in_check
-                is_king_square_and_game_over = self.game_over and self.board[row][col] == KING
-
-                if is_king_square_and_game_over or (is_king_square_and_check and not self.game_over): color = RED
-                elif is_selected: color = GREEN
-                elif is_possible_move: color = SKY_BLUE
-                else: color = BLACK if (row + col) % 2 == 0 else WHITE
-                pygame.draw.rect(self.win, color, rect)
-
-                piece = self.board[row][col]
-                if piece == KING: self.win.blit(self.king_img, (rect.x + 5, rect.y + 5))
-                elif piece == KNIGHT: self.win.blit(self.knight_img, (rect.x + 5, rect.y + 5))
+        # Overlay the dynamic highlights; later draws take precedence
+        for row, col in self.possible_moves:
+            pygame.draw.rect(self.win, SKY_BLUE, square_rect(row, col))
+        if self.selected_piece_pos:
+            pygame.draw.rect(self.win, GREEN, square_rect(*self.selected_piece_pos))
+        if self.king_pos and (self.game_over or king_in_check):
+            pygame.draw.rect(self.win, RED, square_rect(*self.king_pos))
+
+        # Draw pieces in one batched call (fblits on pygame-ce, blits otherwise)
+        piece_blits = []
+        for sq, piece in enumerate(self.board):
+            if piece == EMPTY: continue
+            row, col = divmod(sq, COLS)
+            piece_blits.append((self.king_img if piece == KING else self.knight_img,
+                                (col * SQUARE_SIZE + 5, row * SQUARE_SIZE + 5)))
+        if hasattr(self.win, "fblits"): self.win.fblits(piece_blits)
+        else: self.win.blits(piece_blits, doreturn=False)
 
         # Draw Turn Indicator
         self.draw_turn_indicator()
 
         # Draw AI Thinking message
         if self.ai_thinking:
-             font = pygame.font.Font(None, 36)
-             ai_text = font.render("AI Thinking...", True, ORANGE, BLACK)
+             ai_text = self._render(self.font_think, "AI Thinking...", ORANGE, BLACK)
              ai_rect = ai_text.get_rect(center=(WIDTH // 2, HEIGHT - 30))
              self.win.blit(ai_text, ai_rect)
 
         # --- Draw AI Taunt Message ---
-        if self.ai_message and time.time() < self.ai_message_timer:
-            font = pygame.font.Font(None, 30) # Slightly smaller font for messages
-            message_surface = font.render(self.ai_message, True, AI_MESSAGE_COLOR) # Use defined color
-            message_rect = message_surface.get_rect(center=(WIDTH // 2, HEIGHT - 65)) # Position above AI thinking text
-
-            # Optional: Add a semi-transparent background for readability
-            bg_rect = message_rect.inflate(10, 5)
-            bg_surface = pygame.Surface(bg_rect.size, pygame.SRCALPHA)
-            bg_surface.fill((0, 0, 0, 150)) # Black background, semi-transparent
-            self.win.blit(bg_surface, bg_rect.topleft)
-
-            self.win.blit(message_surface, message_rect)
-        elif self.ai_message and time.time() >= self.ai_message_timer:
-            self.ai_message = None # Clear message after timer expires
+        if self.ai_message:
+            surface, pos = self._taunt_surfs[self.ai_message]
+            self.win.blit(surface, pos, special_flags=pygame.BLEND_PREMULTIPLIED)
         # --- End AI Taunt Message Drawing ---
 
         # Draw Game Over screen if applicable
         if self.game_over:
             self.display_game_over()
 
-        pygame.display.update()
+        # Push only the changed regions unless a full repaint was requested
+        if self._full_repaint:
+            pygame.display.flip(); self._full_repaint = False
+        else:
+            pygame.display.update(self.dirty)
+        self.dirty.clear()
 
     def draw_turn_indicator(self):
         """Draws the turn indicator text, including AI status."""
-        # --- Unchanged ---
-        font = pygame.font.Font(None, 28)
         player_text = ""
         if self.player_turn == 1: player_text = "King (Player 1)"
         elif self.player_turn == 2: player_text = "Knights (AI)" if self.game_mode == 'pva' else "Knights (Player 2)"
         text = f"Turn: {self.turn_count} | {player_text} to move"
-        indicator_surface = font.render(text, True, BLACK, YELLOW)
+        indicator_surface = self._render(self.font_indicator, text, BLACK, YELLOW)
         indicator_rect = indicator_surface.get_rect(center=(WIDTH // 2, SQUARE_SIZE // 3))
         self.win.blit(indicator_surface, indicator_rect)
-        font_small = pygame.font.Font(None, 20)
         charge_cd_text = f"Charge CD: {self.king_charge_cooldown}" if self.king_charge_cooldown > 0 else "Charge Ready (C)"
         escape_text = "Escape Available (E)" if self.king_escape_available else "Escape Used"
-        charge_surf = font_small.render(charge_cd_text, True, WHITE); escape_surf = font_small.render(escape_text, True, WHITE)
+        charge_surf = self._render(self.font_small, charge_cd_text, WHITE); escape_surf = self._render(self.font_small, escape_text, WHITE)
         self.win.blit(charge_surf, (10, HEIGHT - 45)); self.win.blit(escape_surf, (10, HEIGHT - 25))
 
     def is_square_under_attack(self, r, c):
         """Checks if a square (r, c) is attacked by any knight."""
-        # --- Unchanged ---
-        for dr, dc in knight_moves:
-            nr, nc = r + dr, c + dc
-            if 0 <= nr < ROWS and 0 <= nc < COLS and self.board[nr][nc] == KNIGHT: return True
-        return False
+        return bool(self._attacked() >> (r * COLS + c) & 1)
 
     def get_valid_moves(self, r, c):
         """Gets valid moves for the piece at (r, c)."""
-        # --- Unchanged ---
         if not (0 <= r < ROWS and 0 <= c < COLS): return []
-        piece = self.board[r][c]; moves = []
-        if piece == KING: current_moves = king_moves
-        elif piece == KNIGHT: current_moves = knight_moves
-        else: return []
-        for dr, dc in current_moves:
-            nr, nc = r + dr, c + dc
-            if 0 <= nr < ROWS and 0 <= nc < COLS:
-                target_content = self.board[nr][nc]
-                if piece == KING:
-                    if target_content in [EMPTY, KNIGHT] and not self.is_square_under_attack(nr, nc): moves.append((nr, nc))
-                elif piece == KNIGHT:
-                    if target_content == EMPTY: moves.append((nr, nc))
-        return moves
+        sq = r * COLS + c; piece = self.board[sq]; board = self.board
+        if piece == KING:
+            attacked_bb = self._attacked()
+            return [divmod(n, COLS) for n in KING_NEIGHBORS[sq]
+                    if board[n] in (EMPTY, KNIGHT) and not attacked_bb >> n & 1]
+        elif piece == KNIGHT:
+            return [divmod(n, COLS) for n in KNIGHT_NEIGHBORS[sq] if board[n] == EMPTY]
+        return []
 
     def select_piece(self, row, col):
         """Handles selecting a piece. Returns True if selection successful."""
-        # --- Unchanged ---
         if self.ai_thinking or (self.game_mode == 'pva' and self.player_turn == 2): return False
+        self._mark_highlights()
         if 0 <= row < ROWS and 0 <= col < COLS:
-            piece = self.board[row][col]
+            piece = self.board[row * COLS + col]
             if (self.player_turn == 1 and piece == KING) or (self.player_turn == 2 and piece == KNIGHT):
-                self.selected_piece_pos = (row, col); self.possible_moves = self.get_valid_moves(row, col)
-                logging.info(f"Player {self.player_turn} selected piece at ({row}, {col}). Possible moves: {self.possible_moves}")
+                self.selected_piece_pos = (row, col); self.possible_moves = set(self.get_valid_moves(row, col))
+                self._mark_highlights()
+                log.info("Player %s selected piece at (%s, %s). Possible moves: %s", self.player_turn, row, col, self.possible_moves)
                 return True
-        self.selected_piece_pos = None; self.possible_moves = []; return False
+        self.selected_piece_pos = None; self.possible_moves = set(); return False
 
     def attempt_move(self, end_row, end_col):
         """Attempts to move the selected piece to (end_row, end_col). Returns True if move successful."""
         if self.selected_piece_pos is None:
-            logging.warning("Attempt move called with no piece selected.")
+            log.warning("Attempt move called with no piece selected.")
             return False
 
         start_row, start_col = self.selected_piece_pos
-        piece_moved = self.board[start_row][start_col]
+        piece_moved = self.board[start_row * COLS + start_col]
+        self._mark_highlights()
 
-        if (end_row, end_col) not in self.get_valid_moves(start_row, start_col):
-            logging.warning(f"Invalid move destination ({end_row}, {end_col}) attempted for piece at {self.selected_piece_pos}")
-            self.selected_piece_pos = None; self.possible_moves = []; return False
+        # Moves offered at selection time (or by an ability); the AI selects without them, so regenerate then
+        legal_moves = self.possible_moves or self.get_valid_moves(start_row, start_col)
+        if (end_row, end_col) not in legal_moves:
+            log.warning("Invalid move destination (%s, %s) attempted for piece at %s", end_row, end_col, self.selected_piece_pos)
+            self.selected_piece_pos = None; self.possible_moves = set(); return False
 
-        # Record state for Undo
-        board_state_before_move = [row[:] for row in self.board]
+        # Record a delta for Undo; the two touched squares are enough to rebuild the board
         move_info = { "start_pos": (start_row, start_col), "end_pos": (end_row, end_col),
-                      "piece_moved": piece_moved, "piece_captured": self.board[end_row][end_col],
+                      "piece_moved": piece_moved, "piece_captured": self.board[end_row * COLS + end_col],
                       "king_kills_before": self.king_kills, "player_turn_before": self.player_turn,
                       "king_pos_before": self.king_pos, "turn_count_before": self.turn_count,
-                      "board_state": board_state_before_move, "charge_cd_before": self.king_charge_cooldown,
+                      "charge_cd_before": self.king_charge_cooldown,
                       "escape_avail_before": self.king_escape_available }
         self.move_history.append(move_info)
 
         # Execute Move
-        target_content = self.board[end_row][end_col]
+        target_content = self.board[end_row * COLS + end_col]
 
         if piece_moved == KING and target_content == KNIGHT:
             self.king_kills += 1
-            logging.info(f"King captured knight at ({end_row}, {end_col}). Total kills: {self.king_kills}")
+            log.info("King captured knight at (%s, %s). Total kills: %s", end_row, end_col, self.king_kills)
             # --- Trigger AI Taunt ---
             if self.game_mode == 'pva':
                 self.ai_message = random.choice(AI_TAUNTS)
                 self.ai_message_timer = time.time() + self.ai_message_duration
-                logging.info(f"AI displayed taunt: {self.ai_message}")
+                log.info("AI displayed taunt: %s", self.ai_message)
             # --- End AI Taunt Trigger ---
 
-        self.board[start_row][start_col] = EMPTY
-        self.board[end_row][end_col] = piece_moved
-        if piece_moved == KING: self.king_pos = (end_row, end_col)
+        self.board[start_row * COLS + start_col] = EMPTY
+        self.board[end_row * COLS + end_col] = piece_moved
+        move_bits = (1 << (start_row * COLS + start_col)) | (1 << (end_row * COLS + end_col))
+        if piece_moved == KING:
+            self.king_pos = (end_row, end_col)
+            self.king_bb ^= move_bits; self.knight_bb &= ~move_bits
+        else:
+            self.knight_bb ^= move_bits
         if self.player_turn == 1 and self.king_charge_cooldown > 0: self.king_charge_cooldown -= 1
+        # The king's check highlight can change with any move, so repaint its old and new squares
+        self._mark_dirty(square_rect(start_row, start_col), square_rect(end_row, end_col),
+                         square_rect(*move_info["king_pos_before"]), square_rect(*self.king_pos), STATUS_RECT)
 
         self.switch_turn()
         self.check_game_over()
-        self.selected_piece_pos = None; self.possible_moves = []; return True
+        if self.game_over: self.invalidate() # The overlay covers the whole window
+        self.queue_ai_move()
+        self.selected_piece_pos = None; self.possible_moves = set(); return True
 
     def switch_turn(self):
         """Switches the player turn and increments turn count."""
-        # --- Unchanged ---
         if self.player_turn == 2: self.turn_count += 1
         self.player_turn = 3 - self.player_turn
-        logging.info(f"Turn switched to Player {self.player_turn}. Turn count: {self.turn_count}")
+        self._mark_dirty(INDICATOR_RECT)
+        log.info("Turn switched to Player %s. Turn count: %s", self.player_turn, self.turn_count)
+
+    def queue_ai_move(self):
+        """Posts AI_MOVE_EVENT if the AI (Knights in 'pva') is now to move."""
+        if self.game_mode == 'pva' and self.player_turn == 2 and not self.game_over:
+            pygame.event.post(pygame.event.Event(AI_MOVE_EVENT))
 
     def check_game_over(self):
         """Checks win/loss conditions and updates game state."""
-        # --- Game over checks ---
+        # --- Game over checks (cheapest first) ---
         king_pos = self.king_pos
-        knight_positions = self.get_piece_positions(KNIGHT)
         if not king_pos:
-            logging.error("King position is invalid/None during game over check.")
+            log.error("King position is invalid/None during game over check.")
             self.winner = 2
             self.game_over = True
             return
         kx, ky = king_pos
 
         # 1. King reaches safe zone
-        if king_pos in safe_zones:
+        if king_pos in SAFE_ZONE_SET:
             self.winner = 1
             self.game_over = True
-            logging.info("Game Over: King reached a safe zone.")
+            log.info("Game Over: King reached a safe zone.")
             return
 
         # 2. King captures enough knights (MODIFIED - now requires 5 kills, not 4)
         if self.king_kills >=3:  # Increased from
             self.winner = 1
             self.game_over = True
-            logging.info(f"Game Over: King captured {self.king_kills} knights (5 or more).")
+            log.info("Game Over: King captured %s knights (5 or more).", self.king_kills)
             return
 
-        # 3. All knights are captured
-        if not knight_positions:
-            self.winner = 1
+        # 3. NEW CONDITION: If game reaches 30 turns, knights win (siege victory)
+        if self.turn_count >= 30:
+            self.winner = 2
             self.game_over = True
-            logging.info("Game Over: All knights captured.")
+            log.info("Game Over: Knights win by siege (30 turns reached).")
             return
 
-        # --- Knight win conditions follow ---
-        # 4. King is surrounded (MODIFIED - now only needs 3 knights, not 4)
-        surrounding_knights = 0
-        for dr, dc in knight_moves:
-            nr, nc = kx + dr, ky + dc
-            if 0 <= nr < ROWS and 0 <= nc < COLS and self.board[nr][nc] == KNIGHT:
-                surrounding_knights += 1
-        if surrounding_knights >= 3:  # Reduced from 4 to 3
-            self.winner = 2
+        # 4. All knights are captured
+        if not self.knight_bb:
+            self.winner = 1
             self.game_over = True
-            logging.info(f"Game Over: King surrounded by {surrounding_knights} knights.")
+            log.info("Game Over: All knights captured.")
             return
 
-        # 5. King has no valid moves
-        king_valid_moves = self.get_valid_moves(kx, ky)
-        if not king_valid_moves:
+        # --- Knight win conditions follow ---
+        # 5. King is surrounded (MODIFIED - now only needs 3 knights, not 4)
+        surrounding_knights = popcount(KNIGHT_ATTACKS[kx * COLS + ky] & self.knight_bb)
+        if surrounding_knights >= 3:  # Reduced from 4 to 3
             self.winner = 2
             self.game_over = True
-            logging.info("Game Over: King has no valid moves.")
+            log.info("Game Over: King surrounded by %s knights.", surrounding_knights)
             return
 
-        # 6. NEW CONDITION: If game reaches 30 turns, knights win (siege victory)
-        if self.turn_count >= 30:
+        # 6. King has no valid moves
+        if not self.get_valid_moves(kx, ky):
             self.winner = 2
             self.game_over = True
-            logging.info("Game Over: Knights win by siege (30 turns reached).")
+            log.info("Game Over: King has no valid moves.")
             return
 
         # Game continues
@@ -371,23 +600,16 @@ class Game:
 
     def get_piece_positions(self, piece_type):
         """Finds all positions of a given piece type."""
-        # --- Unchanged ---
-        positions = [];
-        for r in range(ROWS):
-            for c in range(COLS):
-                if self.board[r][c] == piece_type: positions.append((r, c))
-        return positions
+        return [divmod(sq, COLS) for sq, piece in enumerate(self.board) if piece == piece_type]
 
     def display_game_over(self):
         """Displays the game over message overlay."""
-        # --- Unchanged ---
-        font = pygame.font.Font(None, 74); winner_text = ""
+        winner_text = ""
         if self.winner == 1: winner_text = "King (Player 1) wins!"
         elif self.winner == 2: winner_text = "Knights (AI) win!" if self.game_mode == 'pva' else "Knights (Player 2) win!"
-        message = winner_text; text = font.render(message, True, YELLOW); text_rect = text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 30))
-        overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA); overlay.fill((0, 0, 0, 180))
-        self.win.blit(overlay, (0, 0)); self.win.blit(text, text_rect)
-        font_small = pygame.font.Font(None, 36); restart_text = font_small.render("Click to Restart", True, WHITE); restart_rect = restart_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 40))
+        message = winner_text; text = self._render(self.font_big, message, YELLOW); text_rect = text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 30))
+        self.win.blit(self._gameover_overlay, (0, 0)); self.win.blit(text, text_rect)
+        restart_text = self._render(self.font_think, "Click to Restart", WHITE); restart_rect = restart_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 40))
         self.win.blit(restart_text, restart_rect)
 
     def handle_click(self, pos):
@@ -413,144 +635,101 @@ class Game:
 
     def undo_last_move(self):
         """Reverts the game state to before the last move."""
-        # --- Unchanged ---
-        if not self.move_history: logging.warning("Undo attempted but move history empty."); return
+        if not self.move_history: log.warning("Undo attempted but move history empty."); return
         last_move = self.move_history.pop()
-        self.board = [row[:] for row in last_move["board_state"]]
+        (sr, sc), (er, ec) = last_move["start_pos"], last_move["end_pos"]
+        self.board[sr * COLS + sc] = last_move["piece_moved"]
+        self.board[er * COLS + ec] = last_move["piece_captured"]
+        move_bits = (1 << (sr * COLS + sc)) | (1 << (er * COLS + ec))
+        if last_move["piece_moved"] == KING:
+            self.king_bb ^= move_bits
+            if last_move["piece_captured"] == KNIGHT: self.knight_bb |= 1 << (er * COLS + ec)
+        else:
+            self.knight_bb ^= move_bits
         self.king_kills = last_move["king_kills_before"]; self.player_turn = last_move["player_turn_before"]
         self.king_pos = last_move["king_pos_before"]; self.turn_count = last_move["turn_count_before"]
         self.king_charge_cooldown = last_move.get("charge_cd_before", 0); self.king_escape_available = last_move.get("escape_avail_before", True)
-        self.selected_piece_pos = None; self.possible_moves = []; self.game_over = False; self.winner = 0
+        self.selected_piece_pos = None; self.possible_moves = set(); self.game_over = False; self.winner = 0
         # Clear any active AI message upon undo
         self.ai_message = None
-        logging.info("Undo successful.")
+        self.invalidate(); self.queue_ai_move()
+        log.info("Undo successful.")
 
     def save_game_state(self, filename="savegame.pkl"):
         """Saves the current game state to a file, including game mode."""
-        # --- Unchanged ---
         game_state = { "board": self.board, "player_turn": self.player_turn, "king_pos": self.king_pos, "king_kills": self.king_kills,
                        "turn_count": self.turn_count, "game_over": self.game_over, "winner": self.winner, "move_history": self.move_history,
                        "player1_time": self.player1_time, "player2_time": self.player2_time, "king_charge_cooldown": self.king_charge_cooldown,
                        "king_escape_available": self.king_escape_available, "game_mode": self.game_mode }
         try:
-            with open(filename, "wb") as f: pickle.dump(game_state, f); logging.info(f"Game saved to {filename}")
-        except Exception as e: logging.error(f"Error saving game: {e}")
+            with open(filename, "wb") as f: pickle.dump(game_state, f); log.info("Game saved to %s", filename)
+        except Exception as e: log.error("Error saving game: %s", e)
 
     def load_game_state(self, filename="savegame.pkl"):
         """Loads game state from a file, including game mode."""
-        # --- Unchanged ---
         try:
             with open(filename, "rb") as f: game_state = pickle.load(f)
-            self.game_mode = game_state.get("game_mode", "pvp"); self.board = game_state.get("board", self.create_board())
-            self.player_turn = game_state.get("player_turn", 1); self.king_pos = game_state.get("king_pos", self._find_king())
+            # Parse everything first so a bad or legacy save can't leave the game half-loaded
+            saved_board = game_state.get("board")
+            if saved_board is None: board = self.create_board()
+            elif isinstance(saved_board, (bytes, bytearray)): board = bytearray(saved_board)
+            else: board = bytearray(LEGACY_PIECE_CODES[piece] for row in saved_board for piece in row) # Rows of '.'/'K'/'N'
+            if len(board) != NUM_SQUARES: raise ValueError(f"board has {len(board)} squares, expected {NUM_SQUARES}")
+            move_history = []
+            for move in game_state.get("move_history", []):
+                move = {key: value for key, value in move.items() if key != "board_state"} # Legacy full-board snapshot
+                move["piece_moved"] = LEGACY_PIECE_CODES.get(move["piece_moved"], move["piece_moved"])
+                move["piece_captured"] = LEGACY_PIECE_CODES.get(move["piece_captured"], move["piece_captured"])
+                move_history.append(move)
+            king_pos = game_state.get("king_pos") or (divmod(board.index(KING), COLS) if KING in board else (ROWS // 2, COLS // 2))
+            self.game_mode = game_state.get("game_mode", "pvp"); self.board = board; self.move_history = move_history
+            self.player_turn = game_state.get("player_turn", 1); self.king_pos = king_pos
             self.king_kills = game_state.get("king_kills", 0); self.turn_count = game_state.get("turn_count", 1)
             self.game_over = game_state.get("game_over", False); self.winner = game_state.get("winner", 0)
-            self.move_history = game_state.get("move_history", []); self.player1_time = game_state.get("player1_time", 300)
+            self.player1_time = game_state.get("player1_time", 300)
             self.player2_time = game_state.get("player2_time", 300); self.king_charge_cooldown = game_state.get("king_charge_cooldown", 0)
             self.king_escape_available = game_state.get("king_escape_available", True)
-            self.selected_piece_pos = None; self.possible_moves = []; self.ai_message = None # Clear message on load
-            logging.info(f"Game loaded from {filename}. Mode: {self.game_mode}"); self.draw()
-        except FileNotFoundError: logging.error(f"Load failed: {filename} not found.")
-        except Exception as e: logging.error(f"Error loading game: {e}")
+            self._sync_bitboards()
+            self.selected_piece_pos = None; self.possible_moves = set(); self.ai_message = None # Clear message on load
+            self.invalidate(); self.queue_ai_move()
+            log.info("Game loaded from %s. Mode: %s", filename, self.game_mode); self.draw()
+        except FileNotFoundError: log.error("Load failed: %s not found.", filename)
+        except Exception as e: log.error("Error loading game: %s", e)
 
     # --- AI Logic ---
     def evaluate_board(self):
         """Evaluates the current board state from the Knights' perspective."""
-        score = 0
         if not self.king_pos:
             return -1000
-
         king_r, king_c = self.king_pos
-        knight_positions = self.get_piece_positions(KNIGHT)
-        king_valid_moves = self.get_valid_moves(king_r, king_c)
-
-        # Heavily penalize having few knights
-        score += len(knight_positions) * 15
-
-        # Reward restricting king's movement
-        score -= len(king_valid_moves) * 10
-
-        # Reward knights being close to the king
-        total_distance = 0
-        for kr, kc in knight_positions:
-            distance = abs(kr - king_r) + abs(kc - king_c)
-            total_distance += distance
-
-            # Reward knights that can attack the king in 1 move
-            potential_moves = self.get_valid_moves(kr, kc)
-            for pr, pc in potential_moves:
-                if abs(pr - king_r) + abs(pc - king_c) <= 2:  # Knight can get close to king
-                    score += 5
-
-        # Calculate average distance and reward closeness
-        if knight_positions:
-            avg_distance = total_distance / len(knight_positions)
-            score += (7 - avg_distance) * 8  # Prefer knights closer to king
-
-        # Reward surrounding the king
-        surrounding_knights = 0
-        for dr, dc in knight_moves:
-            nr, nc = king_r + dr, king_c + dc
-            if 0 <= nr < ROWS and 0 <= nc < COLS and self.board[nr][nc] == KNIGHT:
-                surrounding_knights += 1
-        score += surrounding_knights * 20  # Heavily reward surrounding
-
-        # Reward knights controlling squares close to safe zones
-        for safe_r, safe_c in safe_zones:
-            for kr, kc in knight_positions:
-                distance_to_safe = abs(kr - safe_r) + abs(kc - safe_c)
-                if distance_to_safe <= 2:
-                    score += 10  # Reward knights close to safe zones
-
-        # Reward knights blocking paths to safe zones
-        king_to_safe_distances = []
-        for safe_r, safe_c in safe_zones:
-            king_to_safe = abs(king_r - safe_r) + abs(king_c - safe_c)
-            king_to_safe_distances.append(king_to_safe)
-
-        # Knights should prioritize blocking the closest safe zone
-        min_distance = min(king_to_safe_distances) if king_to_safe_distances else 0
-        for kr, kc in knight_positions:
-            for safe_r, safe_c in safe_zones:
-                safe_distance = abs(safe_r - kr) + abs(safe_c - kc)
-                king_to_safe = abs(king_r - safe_r) + abs(king_c - safe_c)
-                if king_to_safe == min_distance and safe_distance <= 2:
-                    score += 15  # Heavily reward blocking the closest safe zone
-
-        # Reward knights that check the king
-        if self.is_square_under_attack(king_r, king_c):
-            score += 25
-
-        # Reward progress through the game (Knights win if game drags on)
-        score += self.turn_count * 2
-
-        return score
+        return evaluate_position(self.knight_bb, self.king_bb, king_r * COLS + king_c, self.turn_count)
 
     def ai_make_move(self):
         """Determines and returns the best move for the Knights AI."""
-        # --- Unchanged ---
-        self.ai_thinking = True; self.draw(); pygame.time.delay(100) # Ensure "Thinking" shows
-        best_move = None; best_score = -float('inf'); possible_ai_moves = []
-        knight_positions = self.get_piece_positions(KNIGHT)
-        for start_pos in knight_positions:
-            r, c = start_pos; valid_moves = self.get_valid_moves(r, c)
-            for end_pos in valid_moves: possible_ai_moves.append((start_pos, end_pos))
-        if not possible_ai_moves: logging.warning("AI has no moves!"); self.ai_thinking = False; return None
-        current_board_state = [row[:] for row in self.board]; current_king_pos = self.king_pos
-        candidate_moves = [] # Store moves with the best score found so far
-        for start_pos, end_pos in possible_ai_moves:
-            start_r, start_c = start_pos; end_r, end_c = end_pos; piece_moved = self.board[start_r][start_c]
-            self.board[start_r][start_c] = EMPTY; self.board[end_r][end_c] = piece_moved
+        self.ai_thinking = True; self._mark_dirty(STATUS_RECT); self.draw(); pygame.time.delay(100) # Ensure "Thinking" shows
+        best_move = None; best_score = -float('inf'); board = self.board
+        # Candidate (start_sq, end_sq) pairs straight from the knight bitboard and neighbor tables
+        possible_ai_moves = [(start_sq, end_sq) for start_sq in squares_of(self.knight_bb)
+                             for end_sq in KNIGHT_NEIGHBORS[start_sq] if board[end_sq] == EMPTY]
+        if not possible_ai_moves: log.warning("AI has no moves!"); self.ai_thinking = False; self._mark_dirty(STATUS_RECT); return None
+        best_squares = None; tie_count = 0 # Reservoir-sample one of the best-scoring moves as we go
+        for start_sq, end_sq in possible_ai_moves:
+            # Make the move on the two touched squares, score it, then unmake it (the king never moves here)
+            piece_moved = board[start_sq]; captured = board[end_sq]
+            board[start_sq] = EMPTY; board[end_sq] = piece_moved
+            move_bits = (1 << start_sq) | (1 << end_sq); self.knight_bb ^= move_bits
             score = self.evaluate_board()
-            self.board = [row[:] for row in current_board_state]; self.king_pos = current_king_pos
+            board[start_sq] = piece_moved; board[end_sq] = captured; self.knight_bb ^= move_bits
             if score > best_score:
-                best_score = score; candidate_moves = [(start_pos, end_pos)] # New best score, reset candidates
+                best_score = score; best_squares = (start_sq, end_sq); tie_count = 1 # New best score
             elif score == best_score:
-                candidate_moves.append((start_pos, end_pos)) # Add to candidates with same best score
-        # Choose randomly among the best moves
-        if candidate_moves: best_move = random.choice(candidate_moves)
-        logging.info(f"AI chose move: {best_move} from {len(candidate_moves)} candidates with score: {best_score}")
-        self.ai_thinking = False; return best_move
+                # Keep the k-th tied move with probability 1/k, i.e. uniformly among all ties
+                tie_count += 1
+                if random.random() * tie_count < 1.0: best_squares = (start_sq, end_sq)
+        if best_squares:
+            start_sq, end_sq = best_squares; best_move = (divmod(start_sq, COLS), divmod(end_sq, COLS))
+        log.info("AI chose move: %s from %s candidates with score: %s", best_move, tie_count, best_score)
+        self.ai_thinking = False; self._mark_dirty(STATUS_RECT); return best_move
 
     # --- Placeholder Methods ---
     def animate_piece_movement(self, sr, sc, er, ec): pass
@@ -565,23 +744,24 @@ class Game:
         extended_moves = []
 
         # Add moves that are 2 squares away in any of the 8 directions
-        for dr, dc in king_moves:
-            nr, nc = king_r + dr * 2, king_c + dc * 2
-            if 0 <= nr < ROWS and 0 <= nc < COLS:
-                # Check if the destination is empty or has a knight
-                if self.board[nr][nc] in [EMPTY, KNIGHT]:
-                    # Check if the destination is not under attack
-                    if not self.is_square_under_attack(nr, nc):
-                        extended_moves.append((nr, nc))
+        attacked_bb = self._attacked()
+        for n in KING_CHARGE_NEIGHBORS[king_r * COLS + king_c]:
+            # Check if the destination is empty or has a knight
+            if self.board[n] in (EMPTY, KNIGHT):
+                # Check if the destination is not under attack
+                if not attacked_bb >> n & 1:
+                    extended_moves.append(divmod(n, COLS))
 
         # If we have valid extended moves, show them
         if extended_moves:
+            self._mark_highlights()
             self.selected_piece_pos = self.king_pos
-            self.possible_moves = extended_moves
+            self.possible_moves = set(extended_moves)
             self.king_charge_cooldown = 5  # Set cooldown for 5 turns
-            logging.info(f"Royal Charge activated. {len(extended_moves)} possible moves.")
+            self._mark_highlights(); self._mark_dirty(STATUS_RECT)
+            log.info("Royal Charge activated. %s possible moves.", len(extended_moves))
         else:
-            logging.info("Royal Charge failed - no valid extended moves.")
+            log.info("Royal Charge failed - no valid extended moves.")
 
     def activate_royal_escape(self):
         """King's emergency escape ability - use once per game."""
@@ -594,114 +774,155 @@ class Game:
         # Find all empty squares not under attack and not adjacent to knights
         for r in range(ROWS):
             for c in range(COLS):
-                if self.board[r][c] == EMPTY and not self.is_square_under_attack(r, c):
+                if self.board[r * COLS + c] == EMPTY and not self.is_square_under_attack(r, c):
                     # Check that it's not adjacent to knights
-                    adjacent_to_knight = False
-                    for dr, dc in king_moves:
-                        nr, nc = r + dr, c + dc
-                        if 0 <= nr < ROWS and 0 <= nc < COLS and self.board[nr][nc] == KNIGHT:
-                            adjacent_to_knight = True
-                            break
+                    adjacent_to_knight = any(self.board[n] == KNIGHT for n in KING_NEIGHBORS[r * COLS + c])
 
                     if not adjacent_to_knight:
                         escape_moves.append((r, c))
 
         # Add safe zones as escape options if they're empty
         for r, c in safe_zones:
-            if self.board[r][c] == EMPTY:
+            if self.board[r * COLS + c] == EMPTY:
                 escape_moves.append((r, c))
 
         # If we have valid escape moves, show them
         if escape_moves:
+            self._mark_highlights()
             self.selected_piece_pos = self.king_pos
-            self.possible_moves = escape_moves
+            self.possible_moves = set(escape_moves)
             self.king_escape_available = False  # One-time use
-            logging.info(f"Royal Escape activated. {len(escape_moves)} possible moves.")
+            self._mark_highlights(); self._mark_dirty(STATUS_RECT)
+            log.info("Royal Escape activated. %s possible moves.", len(escape_moves))
         else:
-            logging.info("Royal Escape failed - no valid escape moves.")
-    def activate_royal_escape(self): logging.info("Royal Escape (Needs Implementation)"); pass
+            log.info("Royal Escape failed - no valid escape moves.")
     def update_timers(self, dt): pass
 
 # --- UI Screens ---
+def _shutdown():
+    """Closes the display and fonts before pygame itself, then exits; the one quit path for every screen."""
+    pygame.display.quit(); pygame.font.quit(); pygame.quit(); sys.exit(0)
+
+# Event types each screen reads; anything else is dropped by SDL before it reaches the queue
+# (one expose type everywhere: pygame 2 sends VIDEOEXPOSE and WINDOWEXPOSED for the same expose)
+MENU_EVENTS = (pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION, pygame.VIDEOEXPOSE)
+GAME_EVENTS = (pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN, AI_MOVE_EVENT, pygame.VIDEOEXPOSE, pygame.ACTIVEEVENT)
+
+def _allow_events(event_types=None):
+    """Queues only `event_types` from now on; None lets every event type through again."""
+    if event_types is None: pygame.event.set_allowed(None)
+    else: pygame.event.set_blocked(None); pygame.event.set_allowed(list(event_types))
+
 def display_homepage(win):
     """Displays the homepage with game mode selection."""
-    # --- Unchanged ---
-    title_font = pygame.font.Font(None, 74); button_font = pygame.font.Font(None, 50)
+    title_font = _font(None, 74); button_font = _font(None, 50)
     buttons = [ {"text": "Player vs Player", "color": GREEN, "action": "pvp"}, {"text": "Player vs AI", "color": ORANGE, "action": "pva"},
                 {"text": "Tutorial", "color": SKY_BLUE, "action": "tutorial"}, {"text": "Settings", "color": YELLOW, "action": "settings"},
                 {"text": "Scores", "color": WHITE, "action": "scores"}, {"text": "Exit", "color": RED, "action": "exit"} ]
-    button_rects = {}; selected_button = None
+    # Labels, positions and both colors never change: work them all out once, not every frame
+    title = title_font.render("Capture the King", True, YELLOW); title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 4 - 20))
+    button_y_start = HEIGHT // 2 - 100; button_height = 55; button_spacing = 15
+    prepared = []
+    for i, button in enumerate(buttons):
+        text_surf = button_font.render(button["text"], True, BLACK); text_rect = text_surf.get_rect(center=(WIDTH // 2, button_y_start + i * (button_height + button_spacing)))
+        prepared.append({"action": button["action"], "text_surf": text_surf, "text_rect": text_rect, "button_rect": text_rect.inflate(40, 20),
+                         "color": button["color"], "hover_color": tuple(min(c + 30, 255) for c in button["color"])})
+    by_action = {entry["action"]: entry for entry in prepared}
+    button_rects = {entry["action"]: entry["button_rect"] for entry in prepared}
+    def hovered_button(pos): return next((action for action, rect in button_rects.items() if rect.collidepoint(pos)), None)
+    def draw_button(entry):
+        button_color = entry["hover_color"] if entry["action"] == selected_button else entry["color"]
+        win.fill(BLUE, entry["button_rect"]); pygame.draw.rect(win, button_color, entry["button_rect"], border_radius=10); win.blit(entry["text_surf"], entry["text_rect"])
+    selected_button = None; redraw = True; _allow_events(MENU_EVENTS)
     while True:
-        win.fill(BLUE); mouse_pos = pygame.mouse.get_pos(); title = title_font.render("Capture the King", True, YELLOW); title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 4 - 20)); win.blit(title, title_rect)
-        button_y_start = HEIGHT // 2 - 100; button_height = 55; button_spacing = 15
-        for i, button in enumerate(buttons):
-            y_pos = button_y_start + i * (button_height + button_spacing); text = button_font.render(button["text"], True, BLACK); text_rect = text.get_rect(center=(WIDTH // 2, y_pos)); button_rect = text_rect.inflate(40, 20)
-            is_hovered = button_rect.collidepoint(mouse_pos); button_color = button["color"]
-            if is_hovered: button_color = tuple(min(c + 30, 255) for c in button["color"]); selected_button = button["action"]
-            else:
-                if selected_button == button["action"]: selected_button = None
-            pygame.draw.rect(win, button_color, button_rect, border_radius=10); win.blit(text, text_rect); button_rects[button["action"]] = button_rect
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: pygame.quit(); sys.exit()
+        if redraw:
+            win.fill(BLUE); win.blit(title, title_rect); selected_button = hovered_button(pygame.mouse.get_pos())
+            for entry in prepared: draw_button(entry)
+            pygame.display.update(); redraw = False
+        # Sleep until something happens instead of repainting an idle menu every frame
+        for event in [pygame.event.wait(100)] + pygame.event.get():
+            if event.type == pygame.QUIT: _shutdown()
+            elif event.type == pygame.MOUSEMOTION:
+                hovered = hovered_button(event.pos)
+                if hovered != selected_button:
+                    # Only the buttons entering or leaving hover change: repaint and push just those
+                    prev_hovered = selected_button; selected_button = hovered
+                    changed = [by_action[action] for action in (prev_hovered, hovered) if action is not None]
+                    for entry in changed: draw_button(entry)
+                    pygame.display.update([entry["button_rect"] for entry in changed])
+            elif event.type == pygame.VIDEOEXPOSE: redraw = True
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    for action, rect in button_rects.items():
-                        if rect.collidepoint(mouse_pos):
-                            if action in ["pvp", "pva"]: return action
-                            elif action == "tutorial": display_tutorial(win)
-                            elif action == "settings": display_settings(win)
-                            elif action == "scores": display_scores(win)
-                            elif action == "exit": pygame.quit(); sys.exit()
-        pygame.display.update()
+                # The hover tracking above already knows which button is under the cursor
+                if event.button == 1 and selected_button is not None:
+                    action = selected_button
+                    if action in ["pvp", "pva"]: _allow_events(); return action
+                    elif action == "tutorial": display_tutorial(win)
+                    elif action == "settings": display_settings(win)
+                    elif action == "scores": display_scores(win)
+                    elif action == "exit": _shutdown()
+                    redraw = True; _allow_events(MENU_EVENTS) # A sub-screen painted over the menu and reset the filter
 def display_loading_screen(win, image_path, duration=2):
     """Displays a loading screen with fade-in and fade-out animation."""
     try:
-        # Load the image
-        loading_image = pygame.image.load("Chess.png").convert_alpha()
-        loading_image = pygame.transform.scale(loading_image, (650, 650))
+        loading_image = _load_scaled(image_path, 650, 650)
     except pygame.error as e:
-        logging.error(f"Error loading loading screen image: {e}")
+        log.error("Error loading loading screen image: %s", e)
         return
 
-    clock = pygame.time.Clock()
-    fade_surface = pygame.Surface((WIDTH, HEIGHT))
-    fade_surface.fill((0, 0, 0))  # Black fade surface
-
-    # Fade-in effect
-    for alpha in range(0, 256, 5):  # Gradually increase alpha
-        fade_surface.set_alpha(255 - alpha)
-        win.blit(loading_image, (0, 0))
-        win.blit(fade_surface, (0, 0))
+    # Flatten the image onto an opaque display-format surface once
+    background = pygame.Surface((WIDTH, HEIGHT)).convert()
+    background.blit(loading_image, (0, 0))
+    # Pre-darken a copy per fade level (multiplying toward black), so every step is a single blit;
+    # the fade-out replays the same frames backwards
+    tinted = []
+    for level in range(0, 256, 17):
+        frame = background.copy(); frame.fill((level, level, level), special_flags=pygame.BLEND_RGB_MULT); tinted.append(frame)
+
+    # Fade-in effect (pygame.time.wait sleeps between steps instead of spinning)
+    for frame in tinted:  # Gradually brighten
+        win.blit(frame, (0, 0))
         pygame.display.update()
-        clock.tick(30)
+        pygame.time.wait(33)
 
     # Display the image for a short duration
     pygame.time.delay(int(duration * 1000))
 
     # Fade-out effect
-    for alpha in range(0, 256, 5):  # Gradually decrease alpha
-        fade_surface.set_alpha(alpha)
-        win.blit(loading_image, (0, 0))
-        win.blit(fade_surface, (0, 0))
+    for frame in reversed(tinted):  # Gradually darken
+        win.blit(frame, (0, 0))
         pygame.display.update()
-        clock.tick(30)
+        pygame.time.wait(33)
 def display_generic_screen(win, title_text, content_lines):
      """Helper function to display simple text screens."""
-     # --- Unchanged ---
-     win.fill(BLUE); title_font = pygame.font.Font(None, 60); content_font = pygame.font.Font(None, 32); button_font = pygame.font.Font(None, 40)
-     title = title_font.render(title_text, True, WHITE); title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 6)); win.blit(title, title_rect)
-     line_y_start = HEIGHT // 3
-     for i, line in enumerate(content_lines): text = content_font.render(line, True, WHITE); text_rect = text.get_rect(center=(WIDTH // 2, line_y_start + i * 40)); win.blit(text, text_rect)
+     title_font = _font(None, 60); content_font = _font(None, 32); button_font = _font(None, 40)
+     title = title_font.render(title_text, True, WHITE); title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 6))
+     # All content lines composited once onto a single transparent surface (one blit per repaint);
+     # it starts a line height above the first line's center so nothing is cut off
+     line_y_start = HEIGHT // 3; content_top = line_y_start - content_font.get_linesize()
+     content = pygame.Surface((WIDTH, HEIGHT - content_top), pygame.SRCALPHA).convert_alpha(); content.fill((0, 0, 0, 0))
+     for i, line in enumerate(content_lines):
+         text = content_font.render(line, True, WHITE); content.blit(text, text.get_rect(center=(WIDTH // 2, line_y_start - content_top + i * 40)))
      back_button_text = button_font.render("Back", True, BLACK); back_button_rect = back_button_text.get_rect(center=(WIDTH // 2, HEIGHT * 5 // 6)); back_button_area = back_button_rect.inflate(40, 20)
-     mouse_pos = pygame.mouse.get_pos(); back_color = GREEN
-     if back_button_area.collidepoint(mouse_pos): back_color = tuple(min(c + 30, 255) for c in GREEN)
-     pygame.draw.rect(win, back_color, back_button_area, border_radius=10); win.blit(back_button_text, back_button_rect); pygame.display.update()
-     waiting = True
+     def draw_back_button():
+         back_color = GREEN_HOVER if back_hovered else GREEN
+         win.fill(BLUE, back_button_area); pygame.draw.rect(win, back_color, back_button_area, border_radius=10); win.blit(back_button_text, back_button_rect)
+     waiting = True; redraw = True; _allow_events(MENU_EVENTS)
      while waiting:
-         for event in pygame.event.get():
-             if event.type == pygame.QUIT: pygame.quit(); sys.exit()
-             elif event.type == pygame.MOUSEBUTTONDOWN:
-                 if event.button == 1 and back_button_area.collidepoint(pygame.mouse.get_pos()): waiting = False
+         if redraw:
+             win.fill(BLUE); win.blit(title, title_rect)
+             win.blit(content, (0, content_top))
+             back_hovered = back_button_area.collidepoint(pygame.mouse.get_pos()); draw_back_button(); pygame.display.update()
+             redraw = False
+         # Nothing animates here, so block until the next event
+         event = pygame.event.wait()
+         if event.type == pygame.QUIT: _shutdown()
+         elif event.type == pygame.MOUSEMOTION:
+             if back_button_area.collidepoint(event.pos) != back_hovered:
+                 back_hovered = not back_hovered; draw_back_button(); pygame.display.update(back_button_area)
+         elif event.type == pygame.VIDEOEXPOSE: redraw = True
+         elif event.type == pygame.MOUSEBUTTONDOWN:
+             if event.button == 1 and back_button_area.collidepoint(event.pos): waiting = False
+     _allow_events()
 
 def display_tutorial(win):
     """Displays the tutorial screen."""
@@ -740,44 +961,52 @@ def display_settings(win):
     display_generic_screen(win, "Settings", settings_options)
 
 # --- Score Handling ---
+# Last parsed scores file, reused until its modification time changes
+_scores_cache = {"filename": None, "mtime": None, "data": None}
+
 def load_scores(filename="scores.json"):
-    # --- Unchanged ---
-    default_scores = {"player1_wins": 0, "player2_wins": 0, "player_vs_ai_wins": 0, "ai_wins": 0, "games_played_pvp": 0, "games_played_pva": 0}
-    if os.path.exists(filename):
-        try:
-            with open(filename, "r") as f: scores = json.load(f)
-            for key in default_scores:
-                if key not in scores: scores[key] = default_scores[key]
-            if "games_played" in scores and "games_played_pvp" not in scores: scores["games_played_pvp"] = scores.get("games_played", 0); del scores["games_played"]
-            return scores
-        except Exception as e: logging.error(f"Error loading scores: {e}. Using defaults."); return default_scores
-    return default_scores
+    default_scores = {"player_vs_ai_wins": 0, "ai_wins": 0, "games_played_pvp": 0, "games_played_pva": 0}
+    try: mtime = os.stat(filename).st_mtime_ns
+    except OSError: return default_scores
+    if _scores_cache["filename"] == filename and _scores_cache["mtime"] == mtime: return dict(_scores_cache["data"])
+    try:
+        with open(filename, "r") as f: scores = json.load(f)
+        # Migrate keys from older score files once, here, rather than on every save
+        if "games_played" in scores and "games_played_pvp" not in scores: scores["games_played_pvp"] = scores["games_played"]
+        scores.pop("games_played", None); scores.pop("player1_wins", None); scores.pop("player2_wins", None)
+        for key in default_scores:
+            if key not in scores: scores[key] = default_scores[key]
+        _scores_cache.update(filename=filename, mtime=mtime, data=dict(scores))
+        return scores
+    except Exception as e: log.error("Error loading scores: %s. Using defaults.", e); return default_scores
 
 def save_scores(scores, filename="scores.json"):
-    # --- Unchanged ---
     try:
-        scores.pop("games_played", None); scores.pop("player1_wins", None); scores.pop("player2_wins", None) # Clean old keys if desired
-        with open(filename, "w") as f: json.dump(scores, f, indent=4); logging.info(f"Scores saved to {filename}")
-    except Exception as e: logging.error(f"Error saving scores: {e}")
+        # Compact JSON to a temp file, then an atomic rename: a crash mid-write can't corrupt scores.json
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f: json.dump(scores, f, separators=(",", ":"))
+        os.replace(tmp_filename, filename)
+        # What was just written is what the next load_scores would parse, so prime the cache with it
+        _scores_cache.update(filename=filename, mtime=os.stat(filename).st_mtime_ns, data=dict(scores))
+        log.info("Scores saved to %s", filename)
+    except Exception as e: log.error("Error saving scores: %s", e)
 
 def update_scores(winner, game_mode):
-     # --- Unchanged ---
-     scores = load_scores()
-     if game_mode == 'pvp': scores["games_played_pvp"] = scores.get("games_played_pvp", 0) + 1
+     scores = load_scores() # Always carries every counter, so plain subscripts are safe
+     if game_mode == 'pvp': scores["games_played_pvp"] += 1
      elif game_mode == 'pva':
-          scores["games_played_pva"] = scores.get("games_played_pva", 0) + 1
-          if winner == 1: scores["player_vs_ai_wins"] = scores.get("player_vs_ai_wins", 0) + 1
-          elif winner == 2: scores["ai_wins"] = scores.get("ai_wins", 0) + 1
+          scores["games_played_pva"] += 1
+          if winner == 1: scores["player_vs_ai_wins"] += 1
+          elif winner == 2: scores["ai_wins"] += 1
      save_scores(scores)
 
 def display_scores(win):
      """Displays game statistics."""
-     # --- Unchanged ---
-     scores = load_scores(); stats = []; stats.append("Game Statistics"); stats.append(""); stats.append(f"-- Player vs Player --")
-     stats.append(f"Games Played: {scores.get('games_played_pvp', 0)}"); stats.append(""); stats.append(f"-- Player vs AI --")
-     stats.append(f"Games Played: {scores.get('games_played_pva', 0)}"); stats.append(f" Player Wins: {scores.get('player_vs_ai_wins', 0)}")
-     stats.append(f" AI Wins: {scores.get('ai_wins', 0)}")
-     pva_games = scores.get('games_played_pva', 0); pva_player_wins = scores.get('player_vs_ai_wins', 0)
+     scores = load_scores()
+     pvp_games = scores["games_played_pvp"]; pva_games = scores["games_played_pva"]
+     pva_player_wins = scores["player_vs_ai_wins"]; ai_wins = scores["ai_wins"]
+     stats = ["Game Statistics", "", "-- Player vs Player --", f"Games Played: {pvp_games}", "", "-- Player vs AI --",
+              f"Games Played: {pva_games}", f" Player Wins: {pva_player_wins}", f" AI Wins: {ai_wins}"]
      if pva_games > 0: pva_win_rate = (pva_player_wins / pva_games) * 100; stats.append(f" Player Win Rate (vs AI): {pva_win_rate:.1f}%")
      else: stats.append(" Player Win Rate (vs AI): N/A")
      display_generic_screen(win, "Scores", stats)
@@ -789,7 +1018,7 @@ def main():
     clock = pygame.time.Clock()
 
     # Display the loading screen
-    display_loading_screen(win, "loading_screen.jpg")  # Replace with your image path
+    display_loading_screen(win, "Chess.png")
 
     while True:  # Outer loop to allow returning to homepage after game ends
         pygame.display.set_caption("Capture the King")
@@ -798,30 +1027,31 @@ def main():
         pygame.display.set_caption(f"Capture the King - {'Player vs AI' if game_mode == 'pva' else 'Player vs Player'}")
         game.score_updated = False  # Reset score updated flag for new game
 
-        run_game = True
+        run_game = True; _allow_events(GAME_EVENTS)
         while run_game:
             dt = clock.tick(60) / 1000.0
 
-            # AI Turn Logic
-            if game.game_mode == 'pva' and game.player_turn == 2 and not game.game_over and not game.ai_thinking:
-                ai_move = game.ai_make_move()
-                if ai_move:
-                    start_pos, end_pos = ai_move
-                    game.selected_piece_pos = start_pos  # Select AI piece
-                    success = game.attempt_move(end_pos[0], end_pos[1])  # Attempt the move
-                    if not success:
-                        logging.error(f"AI failed to execute move: {ai_move}")
-                else:
-                    logging.info("AI returned no move.")
-                game.ai_thinking = False  # Ensure flag is cleared
-
             # Event Handling
             if not game.ai_thinking:
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
-                        run_game = False
-                        pygame.quit()
-                        sys.exit()  # Exit completely on QUIT
+                        _shutdown()  # Exit completely on QUIT
+                    if event.type in (pygame.VIDEOEXPOSE, pygame.ACTIVEEVENT):
+                        game.invalidate()  # Window uncovered or refocused: repaint everything
+                    if event.type == AI_MOVE_EVENT:
+                        # Stale if an undo, restart or game over came first; otherwise the AI moves now
+                        if game.game_mode == 'pva' and game.player_turn == 2 and not game.game_over and not game.ai_thinking:
+                            ai_move = game.ai_make_move()
+                            if ai_move:
+                                start_pos, end_pos = ai_move
+                                game.selected_piece_pos = start_pos  # Select AI piece
+                                success = game.attempt_move(end_pos[0], end_pos[1])  # Attempt the move
+                                if not success:
+                                    log.error("AI failed to execute move: %s", ai_move)
+                            else:
+                                log.info("AI returned no move.")
+                            game.ai_thinking = False  # Ensure flag is cleared
+                        continue
                     if not game.game_over:
                         if event.type == pygame.MOUSEBUTTONDOWN:
                             if event.button == 1:
@@ -834,7 +1064,7 @@ def main():
                             run_game = False
                             # game.reset_game_state() # Reset happens when new game starts
 
-            # Drawing
+            # Drawing (skipped by the game when nothing changed)
             game.draw()
 
             # Update scores if game just ended